@@ -8,13 +8,18 @@ Use aeronav_download.py to download the chart ZIP files first.
 Command Line Arguments:
     --zippath: Specify the directory containing downloaded Aeronav ZIP files.
     --tmppath: Specify the directory to store temporary files (default: /tmp/aeronav2tiles).
+    --shm-path: Specify a separate directory, such as a tmpfs under /dev/shm, for the reprojected datasets (default: the tmppath).
     --outpath: Specify the directory to store the output tilesets.
+    --mbtiles: Write each tileset to a single MBTiles file in the outpath instead of a directory of tiles. Requires --outpath.
     --all: Generate all tilesets.
     --tilesets: Specify the tilesets to generate.
     --existing: [DEVELOPMENT] Use existing reprojected datasets.
+    --force: Reproject datasets even if their reprojected output is up to date.
     --epsg: Specify the destination EPSG code (default: 3857 for Web Mercator).
     --reproject-resampling: Specify the resampling method to use when reprojecting the data (default: bilinear). Can be one of nearest, bilinear, cubic, cubicspline, lanczos, average, mode.
     --tile-resampling: Specify the resampling method to use when creating tiles (default: bilinear).
+    --warp-mem-limit: Specify the working memory for reprojection in MB (default: 512).
+    --tile-threads: Generate tiles on threads that share one GDAL block cache, instead of on worker processes.
     --cleanup: Remove the temporary directory and its contents after processing.
 
 Usage:
@@ -26,26 +31,61 @@ Raises:
 '''
 
 import argparse
+import contextlib
+import functools
+import hashlib
 import json
 import math
+import multiprocessing
 import os
 import shutil
-import xml.etree.ElementTree as ET
+import threading
 import zipfile
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from xml.sax.saxutils import escape
 
 import numpy
 import rasterio.control
 import rasterio.crs
 import rasterio.enums
+import rasterio.errors
 import rasterio.features
 import rasterio.transform
 import rasterio.warp
 import rasterio.windows
 
+# Numba is optional. When available, palette expansion uses a row-parallel JIT kernel. Numba is slow to import, so it
+# is only loaded, by _load_numba, in the processes that expand palettes.
+numba = None
+_expand_palette_numba = None
+
 # Global config storage (loaded lazily)
 datasets: dict = {}
 tileset_datasets: dict = {}
+dataset_tilesets: dict = {}  # dataset name -> frozenset of the tilesets that include it
+
+# Coordinate system for raw lat/lon coordinates, built once since constructing a CRS initializes PROJ
+_GEO_CRS = rasterio.crs.CRS.from_epsg(4326)
+
+# Destination coordinate systems, by EPSG code
+_DST_CRS_CACHE: dict = {}
+
+# Results of transform_from_gcps and get_center_latitude_from_bounds, by their inputs and the source CRS's WKT
+_GCP_TRANSFORM_CACHE: dict = {}
+_CENTER_LATITUDE_CACHE: dict = {}
+
+def available_cpu_count():
+    """Return the number of CPUs this process may run on, honoring affinity masks set by containers and schedulers."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        # os.sched_getaffinity is not available on all platforms (e.g. macOS, Windows)
+        return os.cpu_count() or 1
+
+def _init_worker():
+    """Set GDAL and PROJ options in a freshly spawned pool worker, leaving any the user has set alone."""
+    # Grids and EPSG definitions come from the local PROJ database; workers should never go to the network for them
+    os.environ.setdefault('PROJ_NETWORK', 'OFF')
 
 def _default_config_path():
     """Return the default config path (aeronav.conf.json next to this script)."""
@@ -53,7 +93,7 @@ def _default_config_path():
 
 def load_config(config_path=None):
     """Load datasets and tilesets from JSON config file."""
-    global datasets, tileset_datasets
+    global datasets, tileset_datasets, dataset_tilesets
 
     if config_path is None:
         config_path = _default_config_path()
@@ -79,85 +119,109 @@ def load_config(config_path=None):
             entry['max_lod'] = ds['max_lod']
         datasets[name] = entry
 
-    # Convert tilesets to expected format
+    # Convert tilesets to expected format, indexing which tilesets each dataset belongs to
     tileset_datasets = {}
+    tileset_index = {}
     for name, ts in config['tilesets'].items():
         tileset_datasets[name] = {
             'tile_path': ts['tile_path'],
             'datasets': ts['datasets'],
         }
+        for dataset_name in ts['datasets']:
+            if dataset_name not in datasets:
+                raise ValueError(f'Tileset "{name}" includes unknown dataset "{dataset_name}"')
+            if name in tileset_index.setdefault(dataset_name, set()):
+                raise ValueError(f'Tileset "{name}" includes dataset "{dataset_name}" more than once')
+            tileset_index[dataset_name].add(name)
+    dataset_tilesets = {dataset_name: frozenset(names) for dataset_name, names in tileset_index.items()}
 
     return datasets, tileset_datasets
 
 # ZIP extraction
 
+def is_macos_metadata(member):
+    '''Return True if a zip member is macOS metadata (a __MACOSX/ entry or an AppleDouble ._ file)'''
+    return member.startswith('__MACOSX/') or os.path.basename(member.rstrip('/')).startswith('._')
+
 def extract_zip(args_tuple):
     '''Extract a single zip file to a destination directory, skipping if all files already exist'''
     zip_path, zip_filename, dest_path, quiet = args_tuple
     zip_full_path = os.path.join(zip_path, zip_filename)
 
-    # Check if all files in the zip already exist in the destination
     with zipfile.ZipFile(zip_full_path, 'r') as zip_archive:
-        members = zip_archive.namelist()
-        all_exist = all(os.path.exists(os.path.join(dest_path, member)) for member in members if not member.endswith('/'))
+        # Skip macOS metadata, which is never read and would otherwise be extracted on every run
+        members = [member for member in zip_archive.namelist() if not is_macos_metadata(member)]
 
-    if all_exist:
-        return zip_filename
+        # Check if all files in the zip already exist in the destination
+        if all(os.path.exists(os.path.join(dest_path, member)) for member in members if not member.endswith('/')):
+            return zip_filename
+
+        if not quiet:
+            print(f'  Extracting {zip_filename}')
+        zip_archive.extractall(dest_path, members=members)
 
-    if not quiet:
-        print(f'  Extracting {zip_filename}')
-    with zipfile.ZipFile(zip_full_path, 'r') as zip_archive:
-        zip_archive.extractall(dest_path)
     if not quiet:
         print(f'  Extracted {zip_filename}')
     return zip_filename
 
 # Preprocessing step
 
-def expand_to_rgb(args_tuple):
+def _expand_palette(src, lookup, out):
+    '''Expand a (height, width) paletted band into a (3, height, width) RGB array in one pass over the source'''
+    for iy in numba.prange(src.shape[0]):
+        for ix in range(src.shape[1]):
+            value = src[iy, ix]
+            out[0, iy, ix] = lookup[0, value]
+            out[1, iy, ix] = lookup[1, value]
+            out[2, iy, ix] = lookup[2, value]
+
+def _load_numba():
+    '''Import numba and JIT-compile _expand_palette on first use, returning False if numba is not installed'''
+    global numba, _expand_palette_numba
+    if _expand_palette_numba is None:
+        try:
+            import numba as numba_module
+        except ImportError:
+            return False
+        numba = numba_module
+        _expand_palette_numba = numba.njit(parallel=True, cache=True)(_expand_palette)
+    return True
+
+def palette_lookup(dataset):
     '''
-    If the file contains a colormap band, expand it to RGB
+    Build an RGB lookup table from a dataset's colormap, if it contains a single colormap band
 
     Parameters
     ----------
-    args_tuple: tuple
-        A tuple of (filename, quiet) where filename is the path to the dataset
+    dataset: DatasetReader
+        The open dataset
 
+    Returns
+    -------
+    ndarray or None
+        A (3, 256) array: three 256 element arrays, one for each RGB band. None if the dataset is not a single
+        paletted band.
     '''
-    filename, quiet = args_tuple
-    basename = os.path.basename(filename)
-
-    with rasterio.open(filename, 'r') as dataset:
-        # If the dataset is not a single paletted band, nothing to do
-        if dataset.count > 1 or dataset.colorinterp[0] != rasterio.enums.ColorInterp.palette:
-            return
-
-        if not quiet:
-            print(f'  Expanding {basename}')
-
-        # Read the profile, palette and data
-        profile = dataset.profile
-        colormap = dataset.colormap(1)
-        src_data = dataset.read()
-
-    # Create new arrays for the expanded data
-    expanded_data = numpy.zeros((3, src_data[0].shape[0], src_data[0].shape[1]), dtype=src_data.dtype)
-
-    # Transpose color table into four 256 element arrays, one for each band
-    colormap_lookup = numpy.array([colormap[i] for i in range(min(256, len(colormap)))]).T
-
-    # Expand the single band to three RGB bands, line by line for good performance
-    for band in range(3):
-        for iy in range(src_data[0].shape[0]):
-            expanded_data[band][iy] = numpy.take(colormap_lookup[band], src_data[0][iy])
+    if dataset.count > 1 or dataset.colorinterp[0] != rasterio.enums.ColorInterp.palette:
+        return None
 
-    # Write the expanded data back to the dataset
-    profile['count'] = 3
-    with rasterio.open(filename, 'w', **profile) as dataset:
-        dataset.write(expanded_data)
-
-    if not quiet:
-        print(f'  Expanded {basename}')
+    # Transpose color table into three 256 element arrays, one for each RGB band. Entries missing from a short
+    # palette are left black.
+    lookup = numpy.zeros((256, 4), dtype=dataset.dtypes[0])
+    for i, rgba in dataset.colormap(1).items():
+        if i < 256:
+            lookup[i] = rgba
+    return lookup[:, :3].T.copy()
+
+def expand_palette(src_data, colormap_lookup):
+    '''Expand a (height, width) paletted array to a (3, height, width) RGB array using a table from palette_lookup'''
+    # The numba kernel does not bounds-check, so it is only used when every possible pixel value has an entry in the
+    # lookup table
+    if src_data.dtype == numpy.uint8 and _load_numba():
+        expanded_data = numpy.empty((3, src_data.shape[0], src_data.shape[1]), dtype=src_data.dtype)
+        _expand_palette_numba(src_data, colormap_lookup, expanded_data)
+        return expanded_data
+    return colormap_lookup[:, src_data]
 
 # Major steps in the processing pipeline
 
@@ -178,21 +242,28 @@ def transform_from_gcps(gcps, src_crs):
     Affine
         An affine transformation matrix representing the new transformation
     '''
-    # Coordinate system for raw lat/lon coordinates
-    geo_crs = rasterio.crs.CRS.from_epsg(4326)
+    # Return the transformation if it has already been calculated
+    key = (tuple(tuple(gcp) for gcp in gcps), src_crs.wkt)
+    if key in _GCP_TRANSFORM_CACHE:
+        return _GCP_TRANSFORM_CACHE[key]
 
     # Get the GCP definitions into separate lists
     gcp_tuple = zip(*gcps)
     xs, ys, lons, lats = gcp_tuple  # type: ignore[misc]
 
     # Transform the lat/lon coordinates to the dataset CRS
-    src_xs, src_ys = rasterio.warp.transform(geo_crs, src_crs, lons, lats)  # type: ignore[assignment]
+    src_xs, src_ys = rasterio.warp.transform(_GEO_CRS, src_crs, lons, lats)  # type: ignore[assignment]
 
     # Create list of GroundControlPoints mapping win_x, win_y to dst_x, dst_y
     gcps_src = [rasterio.control.GroundControlPoint(*point) for point in zip(ys, xs, src_xs, src_ys)]
 
     # Return a new transformation from the GCPs
-    return rasterio.transform.from_gcps(gcps_src)
+    _GCP_TRANSFORM_CACHE[key] = rasterio.transform.from_gcps(gcps_src)
+    return _GCP_TRANSFORM_CACHE[key]
+
+def is_axis_aligned_rectangle(ring):
+    '''Return True if a polygon ring is an axis-aligned rectangle, i.e. it is exactly its own bounding box'''
+    return len({pt[0] for pt in ring}) == 2 and len({pt[1] for pt in ring}) == 2
 
 # Replacement for rasterio.windows.bounds that works with rotated datasets
 def bounds_with_rotation(window, transform):
@@ -218,6 +289,12 @@ def bounds_with_rotation(window, transform):
     col_min = window.col_off
     col_max = col_min + window.width
 
+    # Without rotation, two opposite corners determine the bounds
+    if transform.b == 0 and transform.d == 0:
+        x0, y0 = transform * (col_min, row_max)
+        x1, y1 = transform * (col_max, row_min)
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
     x0, y0 = transform * (col_min, row_max)
     x1, y1 = transform * (col_max, row_max)
     x2, y2 = transform * (col_min, row_min)
@@ -229,6 +306,82 @@ def bounds_with_rotation(window, transform):
     top = max(y0, y1, y2, y3)
     return left, bottom, right, top
 
+def source_pixel_grid(dst_transform, dst_width, dst_height, dst_crs, src_transform, src_crs, step=64):
+    '''
+    Map a grid of destination pixel positions to source pixel coordinates in a single batched transform
+
+    Parameters
+    ----------
+    dst_transform: Affine
+        The destination transformation
+    dst_width, dst_height: int
+        The size of the destination dataset, in pixels
+    dst_crs: CRS
+        The destination coordinate reference system
+    src_transform: Affine
+        The source transformation, which may be rotated
+    src_crs: CRS
+        The source coordinate reference system
+    step: int
+        The spacing of the grid, in destination pixels. The last row and column lie on the far edges of the dataset
+
+    Returns
+    -------
+    cols, rows: ndarray
+        Source pixel coordinates of each grid point, indexed by [grid row, grid column]. Points that cannot be
+        transformed are not finite.
+    '''
+    grid_cols = numpy.append(numpy.arange(0, dst_width, step), dst_width)
+    grid_rows = numpy.append(numpy.arange(0, dst_height, step), dst_height)
+    xs, ys = dst_transform * numpy.meshgrid(grid_cols, grid_rows)
+    src_xs, src_ys = rasterio.warp.transform(dst_crs, src_crs, xs.ravel(), ys.ravel())
+    cols, rows = ~src_transform * (numpy.asarray(src_xs), numpy.asarray(src_ys))
+    return cols.reshape(xs.shape), rows.reshape(xs.shape)
+
+def window_from_pixels(cols, rows, width, height, halo=0):
+    '''Get the window covering pixel coordinates, grown by a halo on every side and clipped to the raster's extent,
+    or None if it does not intersect the raster'''
+    col_min = max(math.floor(cols.min()) - halo, 0)
+    col_max = min(math.ceil(cols.max()) + halo, width)
+    row_min = max(math.floor(rows.min()) - halo, 0)
+    row_max = min(math.ceil(rows.max()) + halo, height)
+
+    if col_min >= col_max or row_min >= row_max:
+        return None
+    return rasterio.windows.Window(col_min, row_min, col_max - col_min, row_max - row_min)  # type: ignore[call-arg]
+
+@functools.lru_cache(maxsize=512)
+def _transform_bounds_cached(src_crs_wkt, dst_crs_wkt, bounds):
+    '''Memoized rasterio.warp.transform_bounds, keyed by the CRS WKT strings and a bounds tuple'''
+    src_crs = rasterio.crs.CRS.from_wkt(src_crs_wkt)
+    dst_crs = rasterio.crs.CRS.from_wkt(dst_crs_wkt)
+    return rasterio.warp.transform_bounds(src_crs, dst_crs, *bounds)
+
+def geobounds_cut_dataset(geobounds, src_bounds, src_crs):
+    '''
+    Determine whether the geobounds from a dataset definition cut into the dataset at all
+
+    Parameters
+    ----------
+    geobounds: tuple
+        A tuple of (left, bottom, right, top) in Lat/Lon coordinates from the dataset definition, any of which may be None
+    src_bounds: tuple
+        A tuple of (left, bottom, right, top) in the source dataset's CRS
+    src_crs: CRS
+        The source coordinate reference system
+
+    Returns
+    -------
+    bool
+        False if every specified side lies on or outside the dataset's own Lat/Lon bounds, so clipping would be a no-op
+    '''
+    left, bottom, right, top = _transform_bounds_cached(src_crs.wkt, _GEO_CRS.wkt, tuple(src_bounds))
+    clip_left, clip_bottom, clip_right, clip_top = geobounds
+    return ((clip_left is not None and clip_left > left) or
+            (clip_bottom is not None and clip_bottom > bottom) or
+            (clip_right is not None and clip_right < right) or
+            (clip_top is not None and clip_top < top))
+
 def clip_to_geobounds(geobounds, src_bounds, src_crs, dst_crs, dst_transform):
     '''
     Calculate the clipped bounds and dimensions for a reprojection based on the geobounds specified in Lat/Lon
@@ -256,17 +409,14 @@ def clip_to_geobounds(geobounds, src_bounds, src_crs, dst_crs, dst_transform):
         The height of the clipped destination dataset
     '''
 
-    # Coordinate system for raw lat/lon coordinates
-    geo_crs = rasterio.crs.CRS.from_epsg(4326)
-
     # Calculate dataset bounds in Lat/Lon
-    src_geobounds = rasterio.warp.transform_bounds(src_crs, geo_crs, *src_bounds)
+    src_geobounds = _transform_bounds_cached(src_crs.wkt, _GEO_CRS.wkt, tuple(src_bounds))
 
     # Replace any None values in our input geobounds with the calculated values
     clip_geobounds = tuple(clip or bnd for clip, bnd in zip(geobounds, src_geobounds))
 
     # Calculate clipped bounds in destination CRS
-    dst_bounds = rasterio.warp.transform_bounds(geo_crs, dst_crs, *clip_geobounds)
+    dst_bounds = _transform_bounds_cached(_GEO_CRS.wkt, dst_crs.wkt, clip_geobounds)
 
     # Get the window corresponding to the clipped bounds
     dst_window = rasterio.windows.from_bounds(*dst_bounds, dst_transform)  # type: ignore[call-arg]
@@ -277,6 +427,64 @@ def clip_to_geobounds(geobounds, src_bounds, src_crs, dst_crs, dst_transform):
     # Return the transform, width and height
     return dst_transform, int(dst_window.width), int(dst_window.height)
 
+def transform_from_geobounds(geobounds, dst_crs, resolution):
+    '''
+    Calculate the bounds and dimensions for a reprojection directly from fully-specified geobounds in Lat/Lon
+
+    This gives the same result as clip_to_geobounds, which only takes the pixel size from the default transform when
+    none of the geobounds are None.
+
+    Parameters
+    ----------
+    geobounds: tuple
+        A tuple of (left, bottom, right, top) in Lat/Lon coordinates from the dataset definition, none of which are None
+    dst_crs: CRS
+        The destination coordinate reference system
+    resolution: float
+        The destination pixel size, in destination CRS units
+
+    Returns
+    -------
+    dst_transform: Affine
+        The destination transformation for the clipped bounds
+    dst_width: int
+        The width of the clipped destination dataset
+    dst_height: int
+        The height of the clipped destination dataset
+    '''
+    # Calculate clipped bounds in destination CRS
+    left, bottom, right, top = _transform_bounds_cached(_GEO_CRS.wkt, dst_crs.wkt, tuple(geobounds))
+
+    # Return the transform, width and height
+    dst_transform = rasterio.Affine(resolution, 0, left, 0, -resolution, top)
+    return dst_transform, int((right - left) / resolution), int((top - bottom) / resolution)
+
+# One ComplexSource element of a mosaic VRT, indented to sit inside its VRTRasterBand
+_VRT_SOURCE_TEMPLATE = '''    <ComplexSource>
+      <SourceFilename>{filename}</SourceFilename>
+      <SourceBand>{band}</SourceBand>
+      <SourceProperties RasterXSize="{width}" RasterYSize="{height}" DataType="{data_type}" />
+      <SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}" />
+      <DstRect xOff="{dst.col_off}" yOff="{dst.row_off}" xSize="{dst.width}" ySize="{dst.height}" />
+      <UseMaskBand>true</UseMaskBand>
+    </ComplexSource>'''
+
+@functools.lru_cache(maxsize=None)
+def _read_vrt_source(file):
+    '''Read the header information build_vrt needs from a single input file, once per file'''
+    with rasterio.open(file) as dataset:
+        return {
+            'crs': dataset.crs,
+            'count': dataset.count,
+            'dtypes': dataset.dtypes,
+            'colorinterp': dataset.colorinterp,
+            'indexes': dataset.indexes,
+            'res': dataset.res,
+            'bounds': dataset.bounds,
+            'width': dataset.width,
+            'height': dataset.height,
+        }
+
 def build_vrt(vrtfile, files):
     '''
     Build a VRT file from a list of input files
@@ -289,51 +497,52 @@ def build_vrt(vrtfile, files):
     files: list
         A list of input files to include in the VRT
     '''
+    # Read every file's header once. Opening a file is mostly I/O and PROJ work, so headers are read concurrently.
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        sources = list(executor.map(_read_vrt_source, files))
+
     # Read global informations from the first file. None of these may change from file to file.
-    with rasterio.open(files[0]) as dataset:
-        crs = dataset.crs
-        count = dataset.count
-        dtypes = dataset.dtypes
-        colorinterps = dataset.colorinterp
-        indexes = dataset.indexes
-        xres = dataset.res[0]
-        yres = dataset.res[1]
-
-    # Read all files to check attributes that must be invariant, and extract information on the spatial extend of the VRT
+    crs = sources[0]['crs']
+    count = sources[0]['count']
+    dtypes = sources[0]['dtypes']
+    colorinterps = sources[0]['colorinterp']
+    indexes = sources[0]['indexes']
+    xres, yres = sources[0]['res']
+
+    # Check attributes that must be invariant, and extract information on the spatial extend of the VRT
     lefts, bottoms, rights, tops = [], [], [], []
-    for file in files:
-        with rasterio.open(file) as dataset:
-            # Ensure the crs and count match the first file
-            if dataset.crs != crs:
-                raise ValueError(f'The crs ({dataset.crs}) from file "{file}" is not {crs}')
-
-            # Ensure the count matches the first file
-            if dataset.count != count:
-                raise ValueError(f'The band count ({dataset.count}) from file "{file}" is not {count}')
-
-            # Ensure the dtypes match the first file
-            if dataset.dtypes != dtypes:
-                raise ValueError(f'The dtypes ({dataset.dtypes}) from file "{file}" do not match the first file')
-
-            # Ensure the colorinterps match the first file
-            if dataset.colorinterp != colorinterps:
-                raise ValueError(f'The colorinterps ({dataset.colorinterp}) from file "{file}" do not match the first file')
-
-            # Ensure the indexes match the first file
-            if dataset.indexes != indexes:
-                raise ValueError(f'The indexes ({dataset.indexes}) from file "{file}" do not match the first file')
-
-            # Track the finest resolution (smallest pixel size) for the VRT
-            if dataset.res[0] < xres:
-                xres = dataset.res[0]
-            if dataset.res[1] < yres:
-                yres = dataset.res[1]
-
-            # Append the spatial extend of the dataset
-            lefts.append(dataset.bounds.left)
-            rights.append(dataset.bounds.right)
-            tops.append(dataset.bounds.top)
-            bottoms.append(dataset.bounds.bottom)
+    for file, source in zip(files, sources):
+        # Ensure the crs and count match the first file
+        if source['crs'] != crs:
+            raise ValueError(f'The crs ({source["crs"]}) from file "{file}" is not {crs}')
+
+        # Ensure the count matches the first file
+        if source['count'] != count:
+            raise ValueError(f'The band count ({source["count"]}) from file "{file}" is not {count}')
+
+        # Ensure the dtypes match the first file
+        if source['dtypes'] != dtypes:
+            raise ValueError(f'The dtypes ({source["dtypes"]}) from file "{file}" do not match the first file')
+
+        # Ensure the colorinterps match the first file
+        if source['colorinterp'] != colorinterps:
+            raise ValueError(f'The colorinterps ({source["colorinterp"]}) from file "{file}" do not match the first file')
+
+        # Ensure the indexes match the first file
+        if source['indexes'] != indexes:
+            raise ValueError(f'The indexes ({source["indexes"]}) from file "{file}" do not match the first file')
+
+        # Track the finest resolution (smallest pixel size) for the VRT
+        if source['res'][0] < xres:
+            xres = source['res'][0]
+        if source['res'][1] < yres:
+            yres = source['res'][1]
+
+        # Append the spatial extend of the dataset
+        lefts.append(source['bounds'].left)
+        rights.append(source['bounds'].right)
+        tops.append(source['bounds'].top)
+        bottoms.append(source['bounds'].bottom)
 
     # Calculate the spatial extend of the merged dataset
     left = min(lefts)
@@ -341,18 +550,10 @@ def build_vrt(vrtfile, files):
     right = max(rights)
     top = max(tops)
 
-    # Start the tree with the VRTDataset element
+    # Calculate the size and transform of the VRT
     total_width = round((right - left) / xres)
     total_height = round((top - bottom) / yres)
-    attr = {"rasterXSize": str(total_width), "rasterYSize": str(total_height)}
-    vrt_dataset_xml = ET.Element("VRTDataset", attr)
-
-    # Build the SRS element
-    ET.SubElement(vrt_dataset_xml, "SRS").text = crs.wkt
-
-    # Build the GeoTransform element
     transform = rasterio.Affine.from_gdal(left, xres, 0, top, 0, -yres)
-    ET.SubElement(vrt_dataset_xml, "GeoTransform").text = ", ".join([str(i) for i in transform.to_gdal()])
 
     # Convert the rasterio dtypes to GDAL data types
     data_types = [{
@@ -372,53 +573,39 @@ def build_vrt(vrtfile, files):
         "cfloat64": "CFloat64",
     }[dtypes[i-1]] for i in indexes]
 
+    # Build the VRT as text. A mosaic has one ComplexSource per file per band, and formatting a template for each
+    # is much cheaper than building an ElementTree and running it through the pure-Python serializer.
+    lines = [f'<VRTDataset rasterXSize="{total_width}" rasterYSize="{total_height}">']
+
+    # Build the SRS element
+    lines.append(f'  <SRS>{escape(crs.wkt)}</SRS>')
+
+    # Build the GeoTransform element
+    lines.append(f'  <GeoTransform>{", ".join([str(i) for i in transform.to_gdal()])}</GeoTransform>')
+
+    # Find where each file lands in the VRT. GDAL handles resampling when source resolution differs from VRT resolution
+    dst_windows = [rasterio.windows.from_bounds(*source_info['bounds'], transform) for source_info in sources]  # type: ignore[call-arg]
+
     # Mosaic VRT file is organized by band first, then file
-    vrt_raster_bands = {}
     for i in indexes:
         # Build the VRTRasterBand element
-        attr = {"dataType": data_types[i-1], "band": str(i)}
-        vrt_raster_bands[i] = ET.SubElement(vrt_dataset_xml, "VRTRasterBand", attr)
+        lines.append(f'  <VRTRasterBand dataType="{data_types[i-1]}" band="{i}">')
 
         # Add the ColorInterp element
         if colorinterps[i-1] != rasterio.enums.ColorInterp.undefined:
-            ET.SubElement(vrt_raster_bands[i], "ColorInterp").text = colorinterps[i-1].name.capitalize()
+            lines.append(f'    <ColorInterp>{colorinterps[i-1].name.capitalize()}</ColorInterp>')
 
-    # Add each file's bands to the VRT
-    for file in files:
-        with rasterio.open(file) as dataset:
-            src = rasterio.windows.Window(0, 0, dataset.width, dataset.height)  # type: ignore[call-arg]
-            dst = rasterio.windows.from_bounds(*dataset.bounds, transform)  # type: ignore[call-arg]
+        # Add each file's band as a source, using the whole source dataset and its mask band so overlapping datasets blend properly
+        for file, source_info, dst in zip(files, sources, dst_windows):
+            lines.append(_VRT_SOURCE_TEMPLATE.format(filename=escape(file), band=i, width=source_info['width'], height=source_info['height'], data_type=data_types[i-1], dst=dst))
 
-        for i in indexes:
-            # Build the Source element. GDAL handles resampling when source resolution differs from VRT resolution
-            source = ET.SubElement(vrt_raster_bands[i], "ComplexSource")
+        lines.append('  </VRTRasterBand>')
 
-            # Add the SourceFilename element
-            ET.SubElement(source, "SourceFilename").text = file
-
-            # Add the SourceBand element
-            ET.SubElement(source, "SourceBand").text = str(i)
-
-            # Add the SourceProperties element
-            attr = { "RasterXSize": str(src.width), "RasterYSize": str(src.height), "DataType": data_types[i-1] }
-            ET.SubElement(source, "SourceProperties", attr)
-
-            # Add the SrcRect element representing the full size of the source dataset
-            attr = {"xOff": str(src.col_off), "yOff": str(src.row_off), "xSize": str(src.width), "ySize": str(src.height)}
-            ET.SubElement(source, "SrcRect", attr)
-
-            # Add the DstRect element
-            attr = {"xOff": str(dst.col_off), "yOff": str(dst.row_off), "xSize": str(dst.width), "ySize": str(dst.height)}
-            ET.SubElement(source, "DstRect", attr)
-
-            # Add the UseMaskBand element so overlapping datasets blend properly
-            ET.SubElement(source, "UseMaskBand").text = "true"
+    lines.append('</VRTDataset>')
 
     # Write the XML file
-    with open(vrtfile, 'wb') as f:
-        tree = ET.ElementTree(vrt_dataset_xml)
-        ET.indent(tree, space="  ")
-        tree.write(f)
+    with open(vrtfile, 'w', encoding='ascii', errors='xmlcharrefreplace') as f:
+        f.write('\n'.join(lines))
 
     return vrtfile
 
@@ -519,13 +706,17 @@ def get_center_latitude_from_bounds(bounds, src_crs):
     '''
     from rasterio.warp import transform as warp_transform
 
+    # Return the latitude if it has already been calculated
+    key = (tuple(bounds), src_crs.wkt)
+    if key in _CENTER_LATITUDE_CACHE:
+        return _CENTER_LATITUDE_CACHE[key]
+
     left, bottom, right, top = bounds
     center_x = (left + right) / 2.0
     center_y = (bottom + top) / 2.0
 
     # Transform center point to WGS84
-    wgs84 = rasterio.crs.CRS.from_epsg(4326)
-    xs, ys = warp_transform(src_crs, wgs84, [center_x], [center_y])
+    xs, ys = warp_transform(src_crs, _GEO_CRS, [center_x], [center_y])
 
     # rasterio returns (x, y) = (lon, lat) for geographic CRS
     lat = ys[0]
@@ -534,9 +725,26 @@ def get_center_latitude_from_bounds(bounds, src_crs):
     if lat < -90.0 or lat > 90.0:
         raise ValueError(f"Invalid latitude {lat:.2f} from coordinate transform")
 
-    return math.radians(lat)
-
-def process(input_full_path, output_full_path, dataset_def, resolution, resampling, dst_epsg=3857, num_threads=None, dataset_name=None, quiet=False):
+    _CENTER_LATITUDE_CACHE[key] = math.radians(lat)
+    return _CENTER_LATITUDE_CACHE[key]
+
+def reprojection_key(input_full_path, dataset_def, resolution, resampling, dst_epsg):
+    '''Return a hash of everything that determines a reprojected output: the input file, the dataset definition and the output parameters'''
+    stat = os.stat(input_full_path)
+    spec = [stat.st_size, stat.st_mtime_ns, dataset_def, resolution, resampling, dst_epsg]
+    return hashlib.blake2b(json.dumps(spec, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+def reprojection_is_current(output_full_path, key):
+    '''Return True if output_full_path was completely written by process() with the given reprojection key'''
+    if not os.path.exists(output_full_path):
+        return False
+    try:
+        with rasterio.open(output_full_path) as dataset:
+            return dataset.tags().get('AERONAV_REPROJECTION_KEY') == key
+    except rasterio.errors.RasterioIOError:
+        return False
+
+def process(input_full_path, output_full_path, dataset_def, resolution, resampling, dst_epsg=3857, num_threads=None, warp_mem_limit=512, dataset_name=None, quiet=False, cache_key=None):
     '''
     Process a single dataset, outputting a dataset reprojected to the specified EPSG coordinate system
 
@@ -555,11 +763,15 @@ def process(input_full_path, output_full_path, dataset_def, resolution, resampli
     dst_epsg: int
         The destination EPSG code (default: 3857 for Web Mercator)
     num_threads: int or None
-        Number of threads for reprojection (default: None uses os.cpu_count())
+        Number of threads for reprojection (default: None uses available_cpu_count())
+    warp_mem_limit: int
+        Working memory for the reprojection in MB (default: 512). Larger values let GDAL warp in fewer chunks
     dataset_name: str or None
         Name of the dataset for progress reporting
     quiet: bool
         If True, suppress progress output
+    cache_key: str or None
+        Reprojection key from reprojection_key, stored in the output so that a later run can tell it is current
 
     Returns
     -------
@@ -567,17 +779,30 @@ def process(input_full_path, output_full_path, dataset_def, resolution, resampli
         The reprojected dataset is written to output_full_path
     '''
     if num_threads is None:
-        num_threads = os.cpu_count() or 1
+        num_threads = available_cpu_count()
 
     if not quiet:
         print(f'  Reprojecting {dataset_name}')
 
     # Open the dataset and read what we need
     with rasterio.open(input_full_path) as dataset:
-        # Read the profile, crs, and transform
+        # Read the profile, crs, transform, and color interpretation
         profile = dataset.profile
         src_crs = dataset.crs
         dataset_transform = dataset.transform
+        src_colorinterp = dataset.colorinterp
+        src_count = dataset.count
+
+        # Paletted datasets are expanded to RGB one source slab at a time, as they are read for reprojection
+        colormap_lookup = palette_lookup(dataset)
+
+    if colormap_lookup is not None:
+        src_colorinterp = (rasterio.enums.ColorInterp.red, rasterio.enums.ColorInterp.green, rasterio.enums.ColorInterp.blue)
+        src_count = 3
+
+        # Give the expansion kernel the same threads as the warp
+        if _load_numba():
+            numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
 
     # Raise ValueError if crs is missing
     if not src_crs:
@@ -612,61 +837,156 @@ def process(input_full_path, output_full_path, dataset_def, resolution, resampli
     src_transform = rasterio.windows.transform(window, dataset_transform)
 
     # Define the destination coordinate system
-    dst_crs = rasterio.crs.CRS.from_epsg(dst_epsg)
-
-    # Calculate the size and transform of the reprojected dataset
-    dst_transform, dst_width, dst_height = rasterio.warp.calculate_default_transform(src_crs, dst_crs, window.width, window.height, *src_bounds, resolution=adjusted_resolution)
-
-    # Ensure dst_width and dst_height are integers (they should be from calculate_default_transform)
-    assert isinstance(dst_width, int) and isinstance(dst_height, int)
+    if dst_epsg not in _DST_CRS_CACHE:
+        _DST_CRS_CACHE[dst_epsg] = rasterio.crs.CRS.from_epsg(dst_epsg)
+    dst_crs = _DST_CRS_CACHE[dst_epsg]
 
-    # If geobounds are specified, we need to further clip the dataset to the specified bounds
+    # If geobounds are specified and they cut into the dataset, we need to further clip the dataset to the specified bounds
     geobounds = dataset_def.get('geobound', None)
-    if geobounds:
-        dst_transform, dst_width, dst_height = clip_to_geobounds(geobounds, src_bounds, src_crs, dst_crs, dst_transform)
-
-    # Read all bands from the dataset
-    with rasterio.open(input_full_path) as dataset:
-        src_data = dataset.read(window=window)
+    clip = geobounds and geobounds_cut_dataset(geobounds, src_bounds, src_crs)
 
-    # Create a shape suitable to rasterize
-    shape = {'type': 'Polygon', 'coordinates': mask}
+    if clip and all(bound is not None for bound in geobounds):
+        # The geobounds fully determine the extent, so the default transform is not needed
+        dst_transform, dst_width, dst_height = transform_from_geobounds(geobounds, dst_crs, adjusted_resolution)
+    else:
+        # Calculate the size and transform of the reprojected dataset
+        dst_transform, dst_width, dst_height = rasterio.warp.calculate_default_transform(src_crs, dst_crs, window.width, window.height, *src_bounds, resolution=adjusted_resolution)
 
-    # Get the transformation for shape drawing (shapes are specified in pixel coordinates relative to the full image)
-    shape_transform = rasterio.Affine.translation(window.col_off, window.row_off)
+        # Ensure dst_width and dst_height are integers (they should be from calculate_default_transform)
+        assert isinstance(dst_width, int) and isinstance(dst_height, int)
 
-    # Rasterize an alpha band based on the shapes
-    alpha_data = rasterio.features.rasterize([shape], (window.height, window.width), transform=shape_transform, default_value=255, dtype='uint8')
+        if clip:
+            dst_transform, dst_width, dst_height = clip_to_geobounds(geobounds, src_bounds, src_crs, dst_crs, dst_transform)
 
-    # Add the alpha band to the source data
-    rgba_data = numpy.append(src_data, [alpha_data], axis=0)
+    # Create a shape suitable to rasterize. It stays in source pixel coordinates and the alpha band is warped along
+    # with the color bands, since a polygon reprojected to the destination CRS would wrap around the world for charts
+    # that cross the antimeridian
+    shape = {'type': 'Polygon', 'coordinates': mask}
 
-    # Create new arrays for the reprojected data
-    output_data = numpy.zeros((len(rgba_data), dst_height, dst_width), dtype=src_data.dtype)
+    # Most masks are a single rectangle that covers the whole window, in which case every pixel is opaque and a
+    # constant fill is much cheaper than rasterizing the polygon
+    mask_is_window = len(mask) == 1 and is_axis_aligned_rectangle(outer_ring)
 
     # Convert resampling method string to rasterio.warp.Resampling enum
     resampling = getattr(rasterio.warp.Resampling, 'cubic_spline' if resampling == 'cubicspline' else resampling)
 
-    # Reproject each band to the destination CRS
-    rasterio.warp.reproject(rgba_data, output_data, src_transform, src_crs=src_crs, dst_transform=dst_transform, dst_crs=dst_crs, resampling=resampling, num_threads=num_threads)
-
-    # Create a new dataset on disk with the reprojected data
+    # Create a new dataset on disk for the reprojected data. It is tiled, so that it can be written one block at a
+    # time, and gets internal overviews so that tile generation at lower zoom levels can read reduced-resolution
+    # data instead of decoding the full-resolution raster. Blocks are compressed with the same threads as the warp.
+    for key in ('blockxsize', 'blockysize', 'tiled', 'interleave', 'photometric'):
+        profile.pop(key, None)
     profile.update({
-        'count': len(output_data),
+        'driver': 'GTiff',
+        'count': src_count + 1,
         'crs': dst_crs,
         'transform': dst_transform,
         'width': dst_width,
         'height': dst_height,
         'compress': 'lzw',
+        'tiled': True,
+        'blockxsize': 512,
+        'blockysize': 512,
+        'interleave': 'pixel',
+        'num_threads': num_threads,
     })
 
-    # Write the reprojected data to disk
-    with rasterio.open(output_full_path, 'w', **profile) as dst:
-        dst.write(output_data)
+    # Map a grid of destination points to source pixel coordinates (relative to the mask window) up front, so each
+    # block's source window can be found without transforming its bounds individually
+    grid_step = 64
+    grid_cols, grid_rows = source_pixel_grid(dst_transform, dst_width, dst_height, dst_crs, src_transform, src_crs, grid_step)
+
+    # Reproject one destination block at a time: read only the source pixels that land in the block (plus a halo for
+    # the resampling kernel), rasterize the alpha band for just those pixels, warp them into a block-sized buffer and
+    # write it out. Peak memory is proportional to the block size instead of the whole dataset. A slab usually spans
+    # several source blocks or strips, which GDAL decompresses on num_threads threads.
+    with rasterio.open(input_full_path, num_threads=num_threads) as dataset, rasterio.open(output_full_path, 'w', **profile) as dst:
+        for _, dst_window in dst.block_windows(1):
+            # Find the source pixels (relative to the mask window) covered by this block, from the grid points on and
+            # inside it. If any of them cannot be transformed, fall back to the whole window.
+            grid_slice = (slice(dst_window.row_off // grid_step, math.ceil((dst_window.row_off + dst_window.height) / grid_step) + 1),
+                          slice(dst_window.col_off // grid_step, math.ceil((dst_window.col_off + dst_window.width) / grid_step) + 1))
+            block_cols = grid_cols[grid_slice]
+            block_rows = grid_rows[grid_slice]
+            if not (numpy.isfinite(block_cols).all() and numpy.isfinite(block_rows).all()):
+                block_cols = numpy.array([0, window.width])
+                block_rows = numpy.array([0, window.height])
+
+            # Blocks outside the mask's bounding box stay transparent, without allocating or rasterizing anything
+            src_window = window_from_pixels(block_cols, block_rows, window.width, window.height)
+            if src_window is None:
+                continue
+
+            # Downsampling kernels are scaled by the ratio of source to destination pixels, so scale the halo too
+            scale = max(src_window.width / dst_window.width, src_window.height / dst_window.height, 1.0)
+            halo = math.ceil(4 * scale) + 1
+            src_window = window_from_pixels(block_cols, block_rows, window.width, window.height, halo)
+
+            # Allocate the source slab with room for an alpha band
+            rgba_data = numpy.empty((src_count + 1, src_window.height, src_window.width), dtype=dataset.dtypes[0])
+            read_window = rasterio.windows.Window(window.col_off + src_window.col_off, window.row_off + src_window.row_off, src_window.width, src_window.height)  # type: ignore[call-arg]
+            alpha_data = rgba_data[-1]
+
+            # Rasterize the alpha band for the slab (shapes are specified in pixel coordinates relative to the full image)
+            if mask_is_window:
+                alpha_data.fill(255)
+            else:
+                alpha_data.fill(0)
+                shape_transform = rasterio.Affine.translation(read_window.col_off, read_window.row_off)
+                rasterio.features.rasterize([shape], out=alpha_data, transform=shape_transform, default_value=255)
+
+                # Nothing in the slab is inside the mask, so the block stays transparent
+                if not alpha_data.any():
+                    continue
+
+            # Read the color bands from the dataset directly into the slab
+            if colormap_lookup is None:
+                dataset.read(window=read_window, out=rgba_data[:-1])
+            else:
+                rgba_data[:-1] = expand_palette(dataset.read(1, window=read_window), colormap_lookup)
+
+            # Reproject all bands of the slab to the destination CRS in a single pass. The block buffer is already
+            # zeroed, so GDAL does not need to initialize it
+            output_data = numpy.zeros((len(rgba_data), int(dst_window.height), int(dst_window.width)), dtype=rgba_data.dtype)
+            block_transform = rasterio.windows.transform(dst_window, dst_transform)
+            slab_transform = rasterio.windows.transform(src_window, src_transform)
+            rasterio.warp.reproject(rgba_data, output_data, slab_transform, src_crs=src_crs, dst_transform=block_transform, dst_crs=dst_crs, resampling=resampling, num_threads=num_threads, warp_mem_limit=warp_mem_limit, init_dest_nodata=False)
+
+            # Write the reprojected block to disk
+            dst.write(output_data, window=dst_window)
+
+        # Mark the alpha band explicitly for the VRT's UseMaskBand blending to work
+        dst.colorinterp = (*src_colorinterp, rasterio.enums.ColorInterp.alpha)
+
+        # Build overviews until the smallest one fits in a single block
+        factors = []
+        factor = 2
+        while max(dst_width, dst_height) * 2 / factor > 512:
+            factors.append(factor)
+            factor *= 2
+        if factors:
+            dst.build_overviews(factors, rasterio.enums.Resampling.average)
+
+        # The key is written last, when the file is closed, so a file left incomplete by an error never looks current
+        if cache_key is not None:
+            dst.update_tags(AERONAV_REPROJECTION_KEY=cache_key)
 
     if not quiet:
         print(f'  Reprojected {dataset_name}')
 
+def remove_directory(path, max_workers):
+    '''Remove a directory and its contents, deleting its top-level entries concurrently'''
+    def remove_entry(entry):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+    # Unlinking is all system calls, which release the GIL, so threads overlap them
+    with os.scandir(path) as entries, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in as_completed([executor.submit(remove_entry, entry) for entry in entries]):
+            future.result()  # Raises any exception that occurred
+    os.rmdir(path)
+
 def main():
     '''
     Main function to process Aeronav data and create web map tiles. How this works:
@@ -744,8 +1064,8 @@ def main():
         Some files, as downloaded from the FAA, contain a single band with a colormap palette. We need to expand
         these to three bands (RGB) so that they can be reprojected and tiled properly. If we didn't do this, or
         did this after reprojection, the resulting colors would be incorrect. This step is done only if needed, and
-        is done in-place with the original files overwritten. Therefore, subsequent runs of this program do not
-        need to repeat this (io-expensive) step.
+        is done in memory as each part of the file is read for reprojection, so the expanded data is never written
+        to disk.
 
     3b. Clip invalid data from the datasets
 
@@ -787,29 +1107,42 @@ def main():
     # Where to put the data
     parser.add_argument('--zippath', help='Directory containing downloaded Aeronav ZIP files.')
     parser.add_argument('-t', '--tmppath', default='/tmp/aeronav2tiles', help='Directory for temporary files. Default: /tmp/aeronav2tiles.')
+    parser.add_argument('--shm-path', help='Directory for reprojected datasets, such as a tmpfs under /dev/shm, so that they are never written to disk. Default: the temp directory.')
     parser.add_argument('-o', '--outpath', help='Output directory for tilesets.')
     # What to do
     parser.add_argument('-s', '--tilesets', default='all', help='Comma-separated tileset names. Default: all.')
     parser.add_argument('-l', '--list', action='store_true', help='List available tilesets and exit.')
     parser.add_argument('--existing', action='store_true', help='[DEV] Use existing reprojected datasets.')
+    parser.add_argument('--force', action='store_true', help='Reproject datasets even if their reprojected output is up to date.')
     parser.add_argument('--single', help='[DEV] Process a single dataset.')
     parser.add_argument('-C', '--cleanup', action='store_true', help='Remove temp directory after processing.')
     # How to do it
     parser.add_argument('-e', '--epsg', type=int, default=3857, help='Target EPSG code. Default: 3857.')
     parser.add_argument('--reproject-resampling', default='bilinear', help='Resampling for reprojection. Default: bilinear.')
     parser.add_argument('--tile-resampling', default='bilinear', help='Resampling for tile generation. Default: bilinear.')
+    parser.add_argument('--warp-mem-limit', type=int, default=512, help='Working memory for reprojection, in MB. Default: 512.')
     parser.add_argument('-f', '--format', default='png', choices=['png', 'jpeg', 'webp'], help='Tile format. Default: png.')
+    parser.add_argument('--mbtiles', action='store_true', help='Write each tileset to a single MBTiles file instead of a directory of tiles. Requires --outpath.')
     parser.add_argument('-q', '--quiet', action='store_true', help='Suppress output.')
     # Parallel processing
-    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help=f'Concurrent dataset processes. Default: {os.cpu_count()}.')
-    parser.add_argument('-w', '--tile-workers', type=int, default=os.cpu_count(), help=f'Parallel workers for tile generation. Default: {os.cpu_count()}.')
+    parser.add_argument('-j', '--jobs', type=int, default=available_cpu_count(), help=f'Concurrent dataset processes. Default: {available_cpu_count()}.')
+    parser.add_argument('-w', '--tile-workers', type=int, default=available_cpu_count(), help=f'Parallel workers for tile generation. While datasets are still being reprojected, tile workers only use the CPUs the reprojection processes leave idle. Default: {available_cpu_count()}.')
+    parser.add_argument('--tile-threads', action='store_true', help='Run tile workers as threads in this process, sharing one GDAL block cache, instead of as separate processes.')
     args = parser.parse_args()
 
+    # Tiles are only generated with an output directory, so --mbtiles would otherwise be silently ignored
+    if args.mbtiles and not args.outpath:
+        parser.error('--mbtiles requires --outpath')
+
     # Load config file
     load_config(args.config)
 
     # Number of CPUs present
-    cpu_count = os.cpu_count() or 1
+    cpu_count = available_cpu_count()
+
+    # Reprojected datasets, and the VRTs that reference them, go to the shared memory directory if one was given.
+    # Tiles are read from these files, so on a tmpfs neither phase touches the disk for them.
+    reprojected_path = args.shm_path or args.tmppath
 
     # List the available tilesets and exit
     if args.list:
@@ -826,18 +1159,25 @@ def main():
         zip_files = [f for f in os.listdir(args.zippath) if f.endswith('.zip') and not f.startswith('._')]
 
         if zip_files:
+            # Sort by size (largest first) so the biggest archives start first and do not straggle at the end
+            zip_files.sort(key=lambda f: os.path.getsize(os.path.join(args.zippath, f)), reverse=True)
+
+            # Extraction is file I/O and zlib decompression, both of which release the GIL, so threads are enough
+            extract_threads = min(cpu_count, len(zip_files))
             if not args.quiet:
-                print(f'Extracting {len(zip_files)} zip files using {cpu_count} parallel processes')
+                print(f'Extracting {len(zip_files)} zip files using {extract_threads} parallel threads')
 
-            # Create work items as tuples for the module-level extract_zip function
+            # Create work items as tuples for the extract_zip function
             work_items = [(args.zippath, f, args.tmppath, args.quiet) for f in zip_files]
 
-            with ProcessPoolExecutor(max_workers=cpu_count) as executor:
-                list(executor.map(extract_zip, work_items))
+            with ThreadPoolExecutor(max_workers=extract_threads) as executor:
+                futures = [executor.submit(extract_zip, work_item) for work_item in work_items]
+                for future in as_completed(futures):
+                    future.result()  # Raises any exception that occurred
 
     # Determine which tilesets to generate
     if args.single:
-        tilesets = [tileset_name for tileset_name, tileset_def in tileset_datasets.items() if args.single in tileset_def['datasets']]
+        tilesets = [tileset_name for tileset_name in tileset_datasets if tileset_name in dataset_tilesets.get(args.single, ())]
     elif args.tilesets.lower() == 'all':
         tilesets = tileset_datasets.keys()
     else:
@@ -845,6 +1185,7 @@ def main():
 
     # Phase 1: Collect all work items from all tilesets
     all_work_items = []
+    queued_datasets = set()
     tileset_reprojected_files = {}  # tileset_name -> list of reprojected file paths
 
     for tileset_name in tilesets:
@@ -860,9 +1201,12 @@ def main():
 
             # Determine the output file path
             output_file = f'_{dataset_name}.tif'
-            output_full_path = os.path.join(args.tmppath, output_file)
+            output_full_path = os.path.join(reprojected_path, output_file)
+
+            # Datasets shared by several tilesets are reprojected once
+            if not args.existing and dataset_name not in queued_datasets:
+                queued_datasets.add(dataset_name)
 
-            if not args.existing:
                 # Get the dataset definition
                 dataset_def = datasets[dataset_name]
 
@@ -887,123 +1231,219 @@ def main():
 
         tileset_reprojected_files[tileset_name] = reprojected_files
 
-    # Phase 2: Process all datasets from all tilesets in one batch
-    if all_work_items:
-        # Sort work items by estimated work (largest first) to reduce straggler effect
-        # Use mask area if available, otherwise fall back to file dimensions
-        def estimate_work(item):
-            mask = item['dataset_def'].get('mask')
-            if mask:
-                outer_ring = mask[0]
-                width = max(pt[0] for pt in outer_ring) - min(pt[0] for pt in outer_ring)
-                height = max(pt[1] for pt in outer_ring) - min(pt[1] for pt in outer_ring)
-                return width * height
-            else:
-                with rasterio.open(item['input_full_path']) as ds:
-                    return ds.width * ds.height
-
-        all_work_items.sort(key=estimate_work, reverse=True)
-
-        # Pre-expand all unique input files to RGB in parallel
-        unique_inputs = list(set(item['input_full_path'] for item in all_work_items))
-        if not args.quiet:
-            print(f'Expanding {len(unique_inputs)} input files to RGB using {cpu_count} parallel processes')
-        expand_work_items = [(f, args.quiet) for f in unique_inputs]
-        with ProcessPoolExecutor(max_workers=cpu_count) as executor:
-            list(executor.map(expand_to_rgb, expand_work_items))
+    # Key each dataset by its input, definition and parameters. The key is stored in the output, even when --force
+    # reprojects it anyway, so that a later run can tell it is current. Datasets whose input is missing get no key
+    # and are kept, so that process() reports the error.
+    for item in all_work_items:
+        if os.path.exists(item['input_full_path']):
+            item['key'] = reprojection_key(item['input_full_path'], item['dataset_def'], item['resolution'], args.reproject_resampling, args.epsg)
+
+    # Skip datasets whose output was already reprojected with the same key
+    if not args.force:
+        current = {item['dataset_name'] for item in all_work_items if 'key' in item and reprojection_is_current(item['output_full_path'], item['key'])}
+        if current:
+            if not args.quiet:
+                print(f'Skipping {len(current)} datasets that are already reprojected')
+            all_work_items = [item for item in all_work_items if item['dataset_name'] not in current]
 
-        # Reproject all datasets in parallel
-        concurrent_processes = min(args.jobs, len(all_work_items))
-        num_threads = max(1, cpu_count // concurrent_processes)
+    # Phase 3 overlaps phase 2: each tileset depends only on its own datasets, so its tiles are generated as soon as
+    # the last of them has been reprojected. Tilesets are prepared on threads and feed one shared tile pool, so
+    # workers stay busy across tileset boundaries.
+    def generate_tileset(tileset_name, tile_executor):
+        '''Build the zoom-specific VRTs for a tileset and generate its tiles on tile_executor'''
+        from tile_manifest import compute_tile_manifest, manifest_summary, get_tileset_zoom_range
+        from rasterio_tiles import generate_tiles_multi_tileset, report
 
-        if not args.quiet:
-            print(f'Reprojecting {len(all_work_items)} datasets using {concurrent_processes} parallel processes ({num_threads} threads each)')
-        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
-            futures = []
-            for item in all_work_items:
-                future = executor.submit(
-                    process,
-                    item['input_full_path'],
-                    item['output_full_path'],
-                    item['dataset_def'],
-                    item['resolution'],
-                    args.reproject_resampling,
-                    args.epsg,
-                    num_threads=num_threads,
-                    dataset_name=item['dataset_name'],
-                    quiet=args.quiet,
-                )
-                futures.append(future)
-
-            # Wait for all futures to complete
-            for future in futures:
-                future.result()  # Raises any exception that occurred
-
-    # Phase 3: Build zoom-specific VRTs and generate tiles for each tileset
-    for tileset_name in tilesets:
         tileset_def = tileset_datasets[tileset_name]
         reprojected_files = tileset_reprojected_files[tileset_name]
 
         if not reprojected_files:
-            continue
+            return
 
-        # Create the tileset from zoom-specific VRTs
-        if args.outpath:
-            # Create the output tileset directory if it does not exist
+        # Create the output tileset directory if it does not exist, or name the tileset's MBTiles file
+        if args.mbtiles:
+            os.makedirs(args.outpath, exist_ok=True)
+            tile_path = os.path.join(args.outpath, tileset_def['tile_path'] + '.mbtiles')
+        else:
             tile_path = os.path.join(args.outpath, tileset_def['tile_path'])
             os.makedirs(tile_path, exist_ok=True)
 
-            from tile_manifest import compute_tile_manifest, manifest_summary, get_tileset_zoom_range
-            from rasterio_tiles import generate_tiles_multi_zoom
-
-            # Derive zoom range from datasets: min=0, max=max(max_lod)
-            min_zoom, max_zoom = get_tileset_zoom_range(tileset_def, datasets)
-
-            # Compute tile manifest based on dataset coverage and max_lod
-            tile_manifest = compute_tile_manifest(
-                tileset_def=tileset_def,
-                datasets=datasets,
-                tmppath=args.tmppath,
-                zoom_min=min_zoom,
-                zoom_max=max_zoom,
-            )
+        # Derive zoom range from datasets: min=0, max=max(max_lod)
+        min_zoom, max_zoom = get_tileset_zoom_range(tileset_def, datasets)
 
-            if not args.quiet:
-                print(f'Building tiles for {tileset_name}')
-                print(manifest_summary(tile_manifest))
-
-            # Build all zoom-specific VRTs upfront
-            # Each zoom level Z uses a VRT containing only datasets where max_lod >= Z,
-            # ordered so that smaller max_lod datasets (more appropriate for that zoom)
-            # are rendered on top.
-            vrt_paths = {}
-            for zoom in range(min_zoom, max_zoom + 1):
-                # Skip zoom levels with no tiles
-                if zoom not in tile_manifest or not tile_manifest[zoom]:
-                    continue
+        # Compute tile manifest based on dataset coverage and max_lod
+        tile_manifest = compute_tile_manifest(
+            tileset_def=tileset_def,
+            datasets=datasets,
+            tmppath=reprojected_path,
+            zoom_min=min_zoom,
+            zoom_max=max_zoom,
+        )
 
-                # Build zoom-specific VRT
-                vrt_path = build_zoom_vrt(tileset_name, tileset_def, datasets, zoom, args.tmppath)
+        # Tilesets are built on concurrent threads, so the summary is printed as one message
+        if not args.quiet:
+            report(f'Building tiles for {tileset_name}\n{manifest_summary(tile_manifest)}')
+
+        # Build all zoom-specific VRTs upfront
+        # Each zoom level Z uses a VRT containing only datasets where max_lod >= Z,
+        # ordered so that smaller max_lod datasets (more appropriate for that zoom)
+        # are rendered on top.
+        # The zoom levels are built one after another: build_vrt reads headers concurrently itself, and each file's
+        # header is only read once, so later zoom levels only write XML.
+        vrt_paths = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            if tile_manifest.get(zoom):
+                vrt_path = build_zoom_vrt(tileset_name, tileset_def, datasets, zoom, tmppath=reprojected_path)
                 if vrt_path is not None:
                     vrt_paths[zoom] = vrt_path
 
-            # Generate all tiles in a single parallel phase
-            generate_tiles_multi_zoom(
-                vrt_paths=vrt_paths,
-                output_path=tile_path,
-                tile_manifest=tile_manifest,
-                resampling=args.tile_resampling,
-                tile_format=args.format.upper(),
-                num_processes=args.tile_workers,
-                quiet=args.quiet,
-            )
+        generate_tiles_multi_tileset(
+            [(vrt_paths, tile_path, tile_manifest)],
+            resampling=args.tile_resampling,
+            tile_format=args.format.upper(),
+            num_processes=args.tile_workers,
+            quiet=args.quiet,
+            executor=tile_executor,
+            mbtiles=args.mbtiles,
+            slots=tile_slots,
+            name=tileset_name,
+        )
+
+    # Datasets each tileset is still waiting on
+    tileset_pending = {tileset_name: set() for tileset_name in tilesets}
+    for item in all_work_items:
+        for tileset_name in dataset_tilesets[item['dataset_name']] & tileset_pending.keys():
+            tileset_pending[tileset_name].add(item['dataset_name'])
+
+    # One slot per tile worker, held by each batch of tiles while it runs. While datasets are still being reprojected,
+    # the slots for CPUs in use by the reprojection pool are held back, so the two pools together stay within the CPU
+    # count instead of oversubscribing it.
+    tile_slots = threading.Semaphore(args.tile_workers)
+
+    with contextlib.ExitStack() as stack:
+        tileset_futures = []
+        if args.outpath:
+            # Tile workers are threads if requested, reading through one shared GDAL block cache. Otherwise they are
+            # processes, spawned rather than forked, as tileset threads may be inside GDAL when they start
+            if args.tile_threads:
+                tile_executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.tile_workers))
+            else:
+                tile_executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.tile_workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker))
+            tileset_executor = stack.enter_context(ThreadPoolExecutor(max_workers=max(1, len(tileset_pending))))
+
+        def start_tileset(tileset_name):
+            '''Queue a tileset for tile generation once all of its datasets are reprojected'''
+            if args.outpath:
+                tileset_futures.append(tileset_executor.submit(generate_tileset, tileset_name, tile_executor))
+
+        # Phase 2: Process all datasets from all tilesets in one batch
+        if all_work_items:
+            os.makedirs(reprojected_path, exist_ok=True)
+
+            # Sort work items by estimated work (largest first) to reduce straggler effect
+            # Use mask area if available, otherwise fall back to file dimensions
+            def estimate_work(item):
+                mask = item['dataset_def'].get('mask')
+                if mask:
+                    xs, ys = zip(*mask[0])
+                    return (max(xs) - min(xs)) * (max(ys) - min(ys))
+                else:
+                    with rasterio.open(item['input_full_path']) as ds:
+                        return ds.width * ds.height
+
+            for item in all_work_items:
+                item['work'] = estimate_work(item)
+            all_work_items.sort(key=lambda item: item['work'], reverse=True)
+
+            # Check up front that the temporary directory can hold the reprojected files rather than failing partway
+            # through. The estimate is uncompressed RGBA at source resolution plus a third for overviews, which is an
+            # upper bound after LZW compression, so a shortfall is reported as a warning
+            estimated_bytes = sum(item['work'] * 4 for item in all_work_items) * 4 // 3
+            existing_bytes = sum(os.path.getsize(item['output_full_path']) for item in all_work_items if os.path.exists(item['output_full_path']))
+            free_bytes = shutil.disk_usage(reprojected_path).free + existing_bytes
+            if estimated_bytes > free_bytes:
+                print(f'Warning: reprojected files may need up to {estimated_bytes / 2**30:.1f} GiB but only {free_bytes / 2**30:.1f} GiB is free in {reprojected_path}')
+
+            # Reproject all datasets in parallel. Pool workers take the next queued dataset as soon as they are free,
+            # so submitting largest first gives each free worker the largest remaining dataset
+            concurrent_processes = min(args.jobs, len(all_work_items))
+            num_threads = max(1, cpu_count // concurrent_processes)
+
+            def reserved_tile_slots(remaining):
+                '''Tile slots to hold back while a number of datasets remain, leaving the tile workers the idle CPUs'''
+                busy_cpus = min(concurrent_processes, remaining) * num_threads
+                return args.tile_workers - min(args.tile_workers, max(0, cpu_count - busy_cpus))
+
+            if not args.quiet:
+                print(f'Reprojecting {len(all_work_items)} datasets using {concurrent_processes} parallel processes ({num_threads} threads each)')
+                print('  Largest: ' + ', '.join(f"{item['dataset_name']} ({item['work']:,.0f} px)" for item in all_work_items[:3]))
+            # Workers are spawned rather than forked so that none inherits the parent's GDAL and PROJ state (open
+            # datasets, the PROJ database connection) or file descriptors
+            with ProcessPoolExecutor(max_workers=concurrent_processes, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker) as executor:
+                futures = {}
+                for item in all_work_items:
+                    future = executor.submit(
+                        process,
+                        item['input_full_path'],
+                        item['output_full_path'],
+                        item['dataset_def'],
+                        item['resolution'],
+                        args.reproject_resampling,
+                        args.epsg,
+                        num_threads=num_threads,
+                        warp_mem_limit=args.warp_mem_limit,
+                        dataset_name=item['dataset_name'],
+                        quiet=args.quiet,
+                        cache_key=item.get('key'),
+                    )
+                    futures[future] = item['dataset_name']
+
+                # Hold back the tile slots for the CPUs the reprojection pool is using
+                remaining = len(futures)
+                reserved = reserved_tile_slots(remaining)
+                for _ in range(reserved):
+                    tile_slots.acquire()
+
+                try:
+                    # Tilesets with nothing to reproject can start right away
+                    for tileset_name, pending in tileset_pending.items():
+                        if not pending:
+                            start_tileset(tileset_name)
+
+                    # Wait for all futures to complete, in completion order so that a failure surfaces as soon as it
+                    # happens, and start each tileset whose last dataset has just finished. Once fewer datasets remain
+                    # than reprojection processes, the CPUs of the idle processes are handed to the tile workers.
+                    for future in as_completed(futures):
+                        future.result()  # Raises any exception that occurred
+                        remaining -= 1
+                        released = reserved - reserved_tile_slots(remaining)
+                        if released:
+                            tile_slots.release(released)
+                            reserved -= released
+                        for tileset_name in dataset_tilesets[futures[future]] & tileset_pending.keys():
+                            pending = tileset_pending[tileset_name]
+                            pending.discard(futures[future])
+                            if not pending:
+                                start_tileset(tileset_name)
+                finally:
+                    if reserved:
+                        tile_slots.release(reserved)
+        else:
+            for tileset_name in tileset_pending:
+                start_tileset(tileset_name)
+
+        # Wait for tile generation to finish
+        for future in as_completed(tileset_futures):
+            future.result()  # Raises any exception that occurred
 
     # Remove the temporary directory and its contents if remove is True
     if args.cleanup:
         if not args.quiet:
             print('Cleaning up temporary files...')
 
-        shutil.rmtree(args.tmppath)
+        remove_directory(args.tmppath, cpu_count)
+        if args.shm_path and os.path.isdir(args.shm_path):
+            remove_directory(args.shm_path, cpu_count)
 
 if __name__ == '__main__':
     main()
@@ -12,14 +12,28 @@ Usage:
 '''
 
 import argparse
+import base64
+import email.utils
+import http.client
 import os
 import re
-import time
+import shutil
+import threading
 import urllib.error
+import urllib.parse
 import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import bs4
 
+# The index pages are parsed with lxml's C parser if it is installed, or Python's html.parser otherwise
+try:
+    import lxml  # noqa: F401
+    _HTML_PARSER = 'lxml'
+except ImportError:
+    _HTML_PARSER = 'html.parser'
+
 # FAA Aeronav index URLs
 _AERONAV_VFR_URL = 'https://www.faa.gov/air_traffic/flight_info/aeronav/digital_products/vfr/'
 _AERONAV_IFR_URL = 'https://www.faa.gov/air_traffic/flight_info/aeronav/digital_products/ifr/'
@@ -28,13 +42,170 @@ _AERONAV_IFR_URL = 'https://www.faa.gov/air_traffic/flight_info/aeronav/digital_
 _VFR_CHART_TYPES = ['sectional', 'terminalArea', 'helicopter', 'grandCanyon', 'Planning', 'caribbean']
 _IFR_CHART_TYPES = ['lowsHighsAreas', 'planning', 'caribbean', 'gulf']
 
+# The chart edition date in a chart file URL
+_DATE_PATTERN = re.compile(r'/(\d{2}-\d{2}-\d{4})/')
+
+# Number of files downloaded at once. Downloads are bound by network latency rather than CPU, so they overlap well
+# on threads; more than this gains little and risks being throttled by the FAA server.
+_DOWNLOAD_WORKERS = 8
+
+# HTTP status codes that redirect a GET request
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Persistent HTTP connections of the current thread, by (scheme, host, proxy), with the headers each request on them needs
+_thread_connections = threading.local()
+
+
+def _proxy_for(parts):
+    '''
+    Finds the proxy to use for a URL, from the http_proxy, https_proxy and no_proxy environment variables or
+    the system's proxy settings, the same way urllib.request does.
+
+    Args:
+        parts (urllib.parse.SplitResult): The split URL.
+
+    Returns:
+        urllib.parse.SplitResult: The split proxy URL, or None to connect to the URL's host directly.
+    '''
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.netloc):
+        return None
+    if '://' not in proxy:
+        proxy = f'http://{proxy}'
+    return urllib.parse.urlsplit(proxy)
+
+
+def _connect(parts, proxy):
+    '''
+    Opens a connection to a URL's host, or to a proxy for it. HTTPS requests go through a CONNECT tunnel
+    to the host, and HTTP requests are sent to the proxy with the full URL as their target.
+
+    Args:
+        parts (urllib.parse.SplitResult): The split URL.
+        proxy (urllib.parse.SplitResult): The split proxy URL from _proxy_for, or None.
+
+    Returns:
+        tuple: The http.client.HTTPConnection, and a dict of headers to add to each request on it.
+    '''
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    if proxy is None:
+        return connection_class(parts.netloc), {}
+
+    # Credentials in the proxy URL are sent with Basic authentication
+    proxy_headers = {}
+    if proxy.username is not None:
+        credentials = f'{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or "")}'
+        proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode('ascii')
+
+    connection = connection_class(proxy.netloc.rpartition('@')[2])
+    if parts.scheme == 'https':
+        connection.set_tunnel(parts.netloc, headers=proxy_headers)
+        return connection, {}
+    return connection, proxy_headers
+
+
+def _open(url, headers=None, max_redirects=5):
+    '''
+    Sends a GET request for the given URL over the calling thread's persistent connection to its host,
+    following redirects. Connections are kept open and reused by later requests from the same thread, so
+    each host costs one TCP and TLS handshake per thread instead of one per request. Proxies are taken
+    from the environment as urllib.request does. The caller must read the response to the end before
+    making another request.
+
+    Args:
+        url (str): The URL to request.
+        headers (dict, optional): Additional request headers. Defaults to None.
+        max_redirects (int, optional): The number of redirects to follow. Defaults to 5.
+
+    Returns:
+        http.client.HTTPResponse: The response, with a status of 200 or 304.
+
+    Raises:
+        urllib.error.HTTPError: If the server returns any other status, or redirects too many times.
+    '''
+    connections = getattr(_thread_connections, 'connections', None)
+    if connections is None:
+        connections = _thread_connections.connections = {}
+    headers = {'User-Agent': f'Python-urllib/{urllib.request.__version__}', **(headers or {})}
+
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        proxy = _proxy_for(parts)
+        key = (parts.scheme, parts.netloc, proxy)
+
+        # A plain HTTP proxy needs the full URL, while a host or a tunnel only needs the path
+        if proxy is not None and parts.scheme == 'http':
+            target = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path or '/', parts.query, ''))
+        else:
+            target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+        # Send the request, reconnecting once if the server has closed an idle connection
+        for attempt in range(2):
+            if key not in connections:
+                connections[key] = _connect(parts, proxy)
+            connection, connection_headers = connections[key]
+            try:
+                connection.request('GET', target, headers={**headers, **connection_headers})
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                del connections[key]
+                if attempt:
+                    raise
+
+        if response.status in _REDIRECT_STATUSES:
+            response.read()
+            url = urllib.parse.urljoin(url, response.getheader('Location'))
+            continue
+        if response.status not in (200, 304):
+            response.read()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return response
+
+    raise urllib.error.HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+
+def _close_connections():
+    '''
+    Closes the calling thread's persistent connections, which must be done after abandoning a response
+    before its end. Later requests from the thread open new connections.
+    '''
+    connections = getattr(_thread_connections, 'connections', {})
+    for connection, _ in connections.values():
+        connection.close()
+    connections.clear()
+
+
+def _is_unchanged(response, file_stat):
+    '''
+    Checks whether a full response is for the same version of a file as the one already saved, by
+    comparing its Last-Modified time and Content-Length with the saved file's modification time and size.
+
+    Args:
+        response (http.client.HTTPResponse): The response, before its body is read.
+        file_stat (os.stat_result): The status of the saved file, or None if there is none.
+
+    Returns:
+        bool: True if the saved file is the version in the response.
+    '''
+    last_modified = response.getheader('Last-Modified')
+    if not last_modified or response.length is None or file_stat is None:
+        return False
+    last_modified_time = email.utils.parsedate_to_datetime(last_modified).timestamp()
+    return file_stat.st_mtime == last_modified_time and file_stat.st_size == response.length
+
 
 def download(url, path='.', filename=None):
     '''
     Downloads a file from the given URL and saves it to the specified path and filename.
     If the filename is not provided, the file will be saved with the basename of the URL.
     If the file already exists, the function will add an 'If-Modified-Since' header to the request
-    to avoid downloading the file again if it has not been modified.
+    to avoid downloading the file again if it has not been modified. A downloaded file is given the
+    server's Last-Modified time, so that the next request asks about exactly that version, and so that
+    a full response for the same version can be recognized from its headers and skipped. The server's
+    ETag, if it sends one, is saved alongside the file with an '.etag' suffix and sent back in an
+    'If-None-Match' header, so that a file republished with identical contents is not downloaded again.
 
     Args:
         url (str): The URL of the file to download.
@@ -42,36 +213,74 @@ def download(url, path='.', filename=None):
         filename (str, optional): The name of the file to save. Defaults to None (uses basename of URL).
 
     Returns:
-        str: The full path of the downloaded file.
+        tuple: The full path of the file, and True if it was downloaded or False if the saved file was
+            already up to date.
 
     Raises:
         urllib.error.HTTPError: If an HTTP error occurs other than a 304 Not Modified response.
+        http.client.IncompleteRead: If the connection closes before the whole file is received.
     '''
-    # Create a request to retrieve the file
-    request = urllib.request.Request(url)
+    headers = {}
 
     # Set filename
     filename = os.path.join(path, filename or os.path.basename(url))
+    etag_filename = filename + '.etag'
 
-    # Check if the file already exists on the filesystem and add the If-Modified-Since header to the request
-    if os.path.exists(filename):
-        last_modified_time = os.path.getmtime(filename)
-        last_modified_time_str = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(last_modified_time))
-        request.add_header('If-Modified-Since', last_modified_time_str)
-
-    # Download the file
+    # Check if the file already exists on the filesystem and add the If-Modified-Since header to the request. The
+    # file is only stat'ed here, and the result is reused below.
     try:
-        with urllib.request.urlopen(request) as response:
-            if response.status == 200:
-                with open(filename, 'wb') as f:
-                    f.write(response.read())
-
-    except urllib.error.HTTPError as e:
-        # Check if the server returned a 304 Not Modified response, if so, just skip the download
-        if e.code != 304:
-            raise
-
-    return filename
+        file_stat = os.stat(filename)
+    except FileNotFoundError:
+        file_stat = None
+    if file_stat is not None:
+        headers['If-Modified-Since'] = email.utils.formatdate(file_stat.st_mtime, usegmt=True)
+
+        # Also add the If-None-Match header, if the server gave the file an ETag
+        try:
+            with open(etag_filename, 'r') as f:
+                etag = f.read().strip()
+            if etag:
+                headers['If-None-Match'] = etag
+        except FileNotFoundError:
+            pass
+
+    # Download the file. A 304 Not Modified response has no body, and the download is skipped
+    downloaded = False
+    with _open(url, headers) as response:
+        if response.status == 200 and _is_unchanged(response, file_stat):
+            # The server ignored If-Modified-Since, but its headers show that the file is the one already saved, so
+            # the body is abandoned unread along with the connection it would have arrived on
+            _close_connections()
+        elif response.status == 200:
+            # Stream the body to a temporary file, in 1 MiB chunks, and only replace the existing file once it is
+            # complete, so that an interrupted download never leaves a truncated file that looks up to date
+            partial_filename = filename + '.part'
+            try:
+                with open(partial_filename, 'wb') as f:
+                    shutil.copyfileobj(response, f, 1024 * 1024)
+                if response.length:
+                    raise http.client.IncompleteRead(b'', response.length)
+
+                last_modified = response.getheader('Last-Modified')
+                if last_modified:
+                    last_modified_time = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                    os.utime(partial_filename, (last_modified_time, last_modified_time))
+                os.replace(partial_filename, filename)
+                downloaded = True
+
+                # Save the ETag once the file is in place, so that it never describes a file other than the saved one
+                etag = response.getheader('ETag')
+                if etag:
+                    with open(etag_filename, 'w') as f:
+                        f.write(etag)
+                elif os.path.exists(etag_filename):
+                    os.remove(etag_filename)
+            except BaseException:
+                if os.path.exists(partial_filename):
+                    os.remove(partial_filename)
+                raise
+
+    return filename, downloaded
 
 
 def get_current_aeronav_urls(index_url, chart_types):
@@ -86,10 +295,11 @@ def get_current_aeronav_urls(index_url, chart_types):
         list: List of GeoTIFF ZIP file URLs found on the page.
     '''
     # Read the page for scraping
-    with urllib.request.urlopen(index_url) as response:
+    with _open(index_url) as response:
         html = response.read().decode('utf-8')
 
-    soup = bs4.BeautifulSoup(html, 'html.parser')
+    # Only the chart type divs are built into the tree; the rest of the page is skipped as it is parsed
+    soup = bs4.BeautifulSoup(html, _HTML_PARSER, parse_only=bs4.SoupStrainer('div', id=chart_types))
 
     urls = []
     for chart_type in chart_types:
@@ -129,11 +339,10 @@ def fix_faa_incorrect_urls(urls):
         list: List of corrected URLs with consistent date paths.
     '''
     url_tuples = []
-    date_pattern = re.compile(r'/(\d{2}-\d{2}-\d{4})/')
 
     # Examine each URL, and find the date in the URL
     for url in urls:
-        match = date_pattern.search(url)
+        match = _DATE_PATTERN.search(url)
         if match:
             # Store everything up to and including the date, then everything after the date
             before_date = url[:match.end(1)]
@@ -143,15 +352,11 @@ def fix_faa_incorrect_urls(urls):
             raise ValueError(f"Could not find date in aeronav URL {url}")
 
     # All "before date" parts should be the same. Tally up the counts of each "before date" part
-    baseurl_counts = {}
-    for before_date, _ in url_tuples:
-        if before_date not in baseurl_counts:
-            baseurl_counts[before_date] = 0
-        baseurl_counts[before_date] += 1
+    baseurl_counts = Counter(before_date for before_date, _ in url_tuples)
 
     # If they are not all the same, use the most common one
     if len(baseurl_counts) > 1:
-        most_common_baseurl = max(baseurl_counts, key=lambda x: baseurl_counts[x])
+        most_common_baseurl = baseurl_counts.most_common(1)[0][0]
         cleaned_urls = []
         for before_date, after_date in url_tuples:
             if before_date != most_common_baseurl:
@@ -180,6 +385,7 @@ Examples:
     parser.add_argument('zippath', nargs='?', help='Directory to store downloaded ZIP files.')
     parser.add_argument('--zippath', dest='zippath_opt', help='Directory to store downloaded ZIP files (alternative to positional argument).')
     parser.add_argument('--quiet', action='store_true', help='Suppress output.')
+    parser.add_argument('-j', '--jobs', type=int, default=_DOWNLOAD_WORKERS, help=f'Number of concurrent downloads. Default: {_DOWNLOAD_WORKERS}.')
     args = parser.parse_args()
 
     # Allow either positional or --zippath argument
@@ -192,9 +398,12 @@ Examples:
     if not quiet:
         print('Scraping aeronav.faa.gov...')
 
-    # Scrape all chart file URLs
-    vfr_urls = get_current_aeronav_urls(_AERONAV_VFR_URL, _VFR_CHART_TYPES)
-    ifr_urls = get_current_aeronav_urls(_AERONAV_IFR_URL, _IFR_CHART_TYPES)
+    # Scrape all chart file URLs, fetching the VFR and IFR index pages concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        vfr_future = executor.submit(get_current_aeronav_urls, _AERONAV_VFR_URL, _VFR_CHART_TYPES)
+        ifr_future = executor.submit(get_current_aeronav_urls, _AERONAV_IFR_URL, _IFR_CHART_TYPES)
+        vfr_urls = vfr_future.result()
+        ifr_urls = ifr_future.result()
 
     # aeronav.faa.gov may have some incorrect URLs, so we need to clean them up
     vfr_urls = fix_faa_incorrect_urls(vfr_urls)
@@ -208,30 +417,29 @@ Examples:
     # Create the directory if it does not exist
     os.makedirs(zippath, exist_ok=True)
 
-    # Download all the files
+    # Download all the files concurrently, reporting each one as it finishes
     downloaded = 0
     skipped = 0
-    for url in all_urls:
-        filename = os.path.basename(url)
-        filepath = os.path.join(zippath, filename)
-        existed = os.path.exists(filepath)
-        old_mtime = os.path.getmtime(filepath) if existed else 0
-
-        if not quiet:
-            print(f'Downloading {filename}...', end=' ', flush=True)
-
-        download(url, zippath)
-
-        # Check if file was actually downloaded or skipped
-        new_mtime = os.path.getmtime(filepath)
-        if existed and new_mtime == old_mtime:
-            skipped += 1
-            if not quiet:
-                print('(not modified)')
-        else:
-            downloaded += 1
-            if not quiet:
-                print('done')
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(download, url, zippath) for url in all_urls]
+        for future in as_completed(futures):
+            try:
+                filepath, was_downloaded = future.result()  # Raises any exception that occurred
+            except BaseException:
+                # Drop the queued downloads, so the error is not held up until every other file is fetched
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            filename = os.path.basename(filepath)
+
+            # Report whether the file was actually downloaded or skipped
+            if was_downloaded:
+                downloaded += 1
+                if not quiet:
+                    print(f'{filename} downloaded')
+            else:
+                skipped += 1
+                if not quiet:
+                    print(f'{filename} (not modified)')
 
     if not quiet:
         print(f'\nDownload complete: {downloaded} downloaded, {skipped} already up to date.')